@@ -1,9 +1,17 @@
-import json
+import functools
 import math
 import operator
+import os
+import re
 import sys
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import (Any, Callable, Deque, Dict, Iterator, List, Optional,
+                    Union)
 
 from aind_data_schema.core.quality_control import (QCEvaluation, QCMetric,
                                                    QCStatus, Stage)
@@ -11,6 +19,94 @@ from aind_data_schema_models.modalities import Modality
 from PIL import Image, ImageDraw, ImageFont
 from pydantic import BaseModel, Field
 
+# Pillow mode used for combined image tiles and canvas
+TILE_MODE = "RGB"
+# White background of the combined image canvas
+BACKGROUND = (255, 255, 255)
+
+
+# Evaluations may be built concurrently, only the first one scans the tree
+_SCAN_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _scan_session(
+    input_dir: Path, max_depth: int
+) -> tuple[tuple[Path, tuple[str, ...]], ...]:
+    """List every directory of a session tree with the files it contains.
+
+    The tree is walked once and the listing is cached, so evaluations built
+    over the same input directory share a single scan.
+
+    Parameters
+    ----------
+    input_dir : Path
+        Input directory containing the data. If it holds a single entry, the
+        search starts from that entry instead
+    max_depth : int
+        Deepest directory level listed, counting the children of the search
+        root as level 1
+
+    Returns
+    -------
+    tuple[tuple[Path, tuple[str, ...]], ...]
+        Directories sorted by path, each with the names of its files
+    """
+    with os.scandir(input_dir) as entries:
+        first, second = next(entries, None), next(entries, None)
+    if first is not None and second is None and first.is_dir():
+        input_dir = Path(first.path)
+    root_depth = len(input_dir.parts)
+    root_stat = input_dir.stat()
+    # Symlinked directories are followed, but each real directory is listed
+    # once so aliases and link cycles are skipped
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    listing = []
+    for dirpath, dirnames, filenames in os.walk(input_dir, followlinks=True):
+        directory = Path(dirpath)
+        if len(directory.parts) - root_depth >= max_depth:
+            dirnames.clear()
+        unvisited = []
+        # Real directories are claimed before links pointing at them
+        paths = {name: os.path.join(dirpath, name) for name in dirnames}
+        for name in sorted(dirnames, key=lambda n: (os.path.islink(paths[n]), n)):
+            try:
+                stat = os.stat(paths[name])
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in visited:
+                visited.add((stat.st_dev, stat.st_ino))
+                unvisited.append(name)
+        dirnames[:] = unvisited
+        listing.append((directory, tuple(filenames)))
+    return tuple(sorted(listing))
+
+
+@functools.lru_cache(maxsize=8)
+def _get_font(size: int = 100) -> ImageFont.ImageFont:
+    """Load the label font once per size, falling back to Pillow's default.
+
+    Parameters
+    ----------
+    size : int, optional
+        Font size in points, by default 100
+
+    Returns
+    -------
+    ImageFont.ImageFont
+        Font used to draw row labels
+    """
+    if sys.platform == "win32":
+        font_path = "C:/Windows/Fonts/arial.ttf"
+    elif sys.platform == "darwin":  # macOS
+        font_path = "/System/Library/Fonts/Helvetica.ttc"
+    else:  # Linux
+        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(font_path, size=size)
+    except Exception:
+        return ImageFont.load_default()
+
 
 class EvaluationSettings(BaseModel):
     """Settings for the evaluation of the registration."""
@@ -32,6 +128,14 @@ class EvaluationSettings(BaseModel):
     modality: Modality.ONE_OF = Field(..., description="Modality of the data")
     evaluations_name: str = Field(..., description="Name of the evaluation")
     allow_failed_metrics: bool = Field(..., description="Allow failed metrics")
+    search_depth: int = Field(
+        default=3,
+        description="Deepest directory level searched below the input directory",
+    )
+    thumbnail_cap: Optional[int] = Field(
+        default=None,
+        description="Maximum tile width and height in pixels for combined images",
+    )
 
 
 class Evaluation:
@@ -61,12 +165,17 @@ class Evaluation:
         Returns
         -------
         list
-            List of directories containing the data
+            List of directories named ``folder_name``, sorted by path
         """
-        input_dir = self.settings.input_directory
-        if len(list(input_dir.glob("*"))) == 1:
-            return [plane for plane in input_dir.glob("*/*")]
-        return [plane for plane in input_dir.rglob("*")]
+        with _SCAN_LOCK:
+            session = _scan_session(
+                self.settings.input_directory, self.settings.search_depth
+            )
+        return [
+            directory
+            for directory, _ in session
+            if directory.name == self.settings.folder_name
+        ]
 
     def _make_directory(self, directory: Path) -> Path:
         """
@@ -88,17 +197,11 @@ class Evaluation:
     def collect_pattern_files(self) -> tuple[List[str], List[Path]]:
         """Collect files matching the pattern in the directories.
 
-        Parameters
-        ----------
-        pattern1 : str
-            Pattern to match in file search
-        pattern2 : Optional[str], optional
-            Second pattern to match in file search, by default None
-
         Returns
         -------
         tuple[List[str], List[Path]]
-            List of file paths matching the pattern
+            Label of the plane each file belongs to, and the file paths
+            matching the pattern, aligned index by index
         """
 
         if not self.directories:
@@ -106,20 +209,121 @@ class Evaluation:
         if not self.settings.pattern:
             raise ValueError("No pattern provided.")
 
-        row_labels: List[str] = []
-        matched_files: List[Path] = []
+        # One alternation matches every pattern in a single scan of each name
+        pattern_matcher = re.compile(
+            "|".join(re.escape(pattern) for pattern in self.settings.pattern)
+        )
+
+        session = _scan_session(
+            self.settings.input_directory, self.settings.search_depth
+        )
+        labeled_files: List[tuple[str, Path]] = []
 
         for directory in self.directories:
-            for pattern in self.settings.pattern:
-                pattern_matches = [
-                    i for i in directory.rglob("*") if pattern in str(i) and i.is_file()
-                ]
-                if pattern_matches:
-                    matched_files.extend(pattern_matches)
-            row_labels.append(directory.parent.name)
+            pattern_matches: Dict[str, List[Path]] = {
+                pattern: [] for pattern in self.settings.pattern
+            }
+            # Sorted paths keep each subtree contiguous, starting at its root
+            start = bisect_left(session, directory, key=operator.itemgetter(0))
+            for index in range(start, len(session)):
+                dirpath, filenames = session[index]
+                if not dirpath.is_relative_to(directory):
+                    break
+                for name in filenames:
+                    match = pattern_matcher.search(name)
+                    if match:
+                        pattern_matches[match.group()].append(dirpath / name)
+            label = directory.parent.name
+            labeled_files.extend(
+                (label, file)
+                for matches in pattern_matches.values()
+                for file in sorted(matches)
+            )
 
+        if not labeled_files:
+            return [], []
+        row_labels, matched_files = map(list, zip(*labeled_files))
         return row_labels, matched_files
 
+    def _tile_size(self, size: tuple[int, int]) -> tuple[int, int]:
+        """Size of a tile once downscaled to the thumbnail cap.
+
+        Parameters
+        ----------
+        size : tuple[int, int]
+            Width and height of the source image
+
+        Returns
+        -------
+        tuple[int, int]
+            Width and height of the tile, keeping the aspect ratio
+        """
+        cap = self.settings.thumbnail_cap
+        width, height = size
+        if not cap or max(width, height) <= cap:
+            return size
+        scale = cap / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _open_image(self, path: Path) -> Image.Image:
+        """Decode an image, downscaling it to the thumbnail cap if one is set.
+
+        Parameters
+        ----------
+        path : Path
+            Path to the image
+
+        Returns
+        -------
+        Image.Image
+            Decoded RGB image, with any transparency flattened onto the
+            background
+        """
+        img = Image.open(path)
+        tile_size = self._tile_size(img.size)
+        if tile_size != img.size and img.format == "JPEG":
+            # Let libjpeg decode at a reduced scale close to the tile size
+            img.draft(TILE_MODE, tile_size)
+        if img.has_transparency_data:
+            # Flatten transparent pixels onto the canvas background
+            img = img.convert("RGBA")
+            background = Image.new("RGBA", img.size, BACKGROUND + (255,))
+            img = Image.alpha_composite(background, img).convert(TILE_MODE)
+        elif img.mode != TILE_MODE:
+            img = img.convert(TILE_MODE)
+        else:
+            img.load()
+        if img.size != tile_size:
+            img = img.resize(tile_size, Image.Resampling.BILINEAR)
+        return img
+
+    def _iter_images(self, image_paths) -> Iterator[Image.Image]:
+        """Decode images in order on a thread pool.
+
+        At most twice as many images as workers are decoded ahead of the
+        consumer, which bounds memory regardless of the number of images.
+
+        Parameters
+        ----------
+        image_paths : List[str]
+            List of paths to images
+
+        Yields
+        ------
+        Image.Image
+            Decoded image, in the order of image_paths
+        """
+        max_workers = os.cpu_count() or 1
+        # Decoding runs in Pillow's C code with the GIL released
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending: Deque[Future] = deque()
+            for path in image_paths:
+                pending.append(executor.submit(self._open_image, path))
+                if len(pending) >= 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     def combine_images(
         self,
         image_paths,
@@ -128,10 +332,14 @@ class Evaluation:
         spacing=10,
         row_labels=None,
         label_width=200,
+        compress_level=1,
     ) -> Path:
         """
         Combine multiple PNG images into a matrix layout with row labels.
 
+        Each cell is sized from the first image. Smaller images are centred in
+        their cell.
+
         Parameters
         ----------
         image_paths : List[str]
@@ -143,64 +351,66 @@ class Evaluation:
         spacing : int, optional
             Pixels of spacing between images, by default 10
         row_labels : List[str], optional
-            List of labels for each row. If None, no labels are added, by default None
+            List of labels for each image. The label of the first image in a row
+            is drawn next to that row. If None, no labels are added, by default None
         label_width : int, optional
             Width in pixels reserved for labels, by default 200
+        compress_level : int, optional
+            zlib compression level (0-9) for the saved PNG, by default 1
 
         Returns
         -------
         None
             Saves the combined image to output_path
+
+        Raises
+        ------
+        ValueError
+            If an image is larger than the first image
         """
-        images = [Image.open(path).convert("RGBA") for path in image_paths]
+        # The first tile sets the cell size, smaller tiles are centred in it
+        with Image.open(image_paths[0]) as img:
+            max_width, max_height = self._tile_size(img.size)
 
-        num_images = len(images)
+        num_images = len(image_paths)
         num_rows = math.ceil(num_images / num_columns)
 
-        widths, heights = zip(*(i.size for i in images))
-        max_width = max(widths)
-        max_height = max(heights)
-
         total_width = (max_width * num_columns) + (spacing * (num_columns - 1))
         if row_labels:
             total_width += label_width + spacing  # Add space for labels
         total_height = (max_height * num_rows) + (spacing * (num_rows - 1))
 
-        new_image = Image.new("RGBA", (total_width, total_height), (255, 255, 255, 0))
+        new_image = Image.new(TILE_MODE, (total_width, total_height), BACKGROUND)
         draw = ImageDraw.Draw(new_image)
 
-        try:
-            if sys.platform == "win32":
-                font_path = "C:/Windows/Fonts/arial.ttf"
-            elif sys.platform == "darwin":  # macOS
-                font_path = "/System/Library/Fonts/Helvetica.ttc"
-            else:  # Linux
-                font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-
-            font = ImageFont.truetype(font_path, size=100)
-        except Exception:
-            font = ImageFont.load_default()
+        font = _get_font()
 
         label_offset = label_width + spacing if row_labels else 0
 
-        for idx, img in enumerate(images):
+        for idx, img in enumerate(self._iter_images(image_paths)):
             row = idx // num_columns
             col = idx % num_columns
 
             x = label_offset + col * (max_width + spacing)
             y = row * (max_height + spacing)
 
-            x_center = x + (max_width - img.size[0]) // 2
-            y_center = y + (max_height - img.size[1]) // 2
-
-            new_image.paste(img, (x_center, y_center))
+            width, height = img.size
+            if width > max_width or height > max_height:
+                raise ValueError(
+                    f"{image_paths[idx]} is {img.size}, larger than the "
+                    f"{(max_width, max_height)} tile size of {image_paths[0]}"
+                )
+            new_image.paste(
+                img, (x + (max_width - width) // 2, y + (max_height - height) // 2)
+            )
+            img.close()
 
-            if col == 0 and row_labels and row < len(row_labels):
+            if col == 0 and row_labels and idx < len(row_labels):
                 # Calculate vertical center of the current row
                 text_y = y + (max_height // 2)
 
                 # Get the size of the text
-                text = str(row_labels[row])
+                text = str(row_labels[idx])
                 try:
                     bbox = draw.textbbox((0, 0), text, font=font)
                     text_height = bbox[3] - bbox[1]
@@ -211,16 +421,16 @@ class Evaluation:
                 draw.text(
                     (spacing, text_y - text_height // 2),
                     text,
-                    fill=(0, 0, 0, 255),  # Black text
+                    fill=(0, 0, 0),  # Black text
                     font=font,
                 )
 
         # Save combined image
-        new_image.save(self.output_directory / image_output_name, "PNG")
-
-        # Close all images
-        for img in images:
-            img.close()
+        new_image.save(
+            self.output_directory / image_output_name,
+            "PNG",
+            compress_level=compress_level,
+        )
         return self.output_directory / image_output_name
 
     def build_qc_metric(self, value: Any, reference: List[Path] = None) -> QCMetric:
@@ -262,7 +472,42 @@ class Evaluation:
             Evaluation object
         """
         with open(self.output_directory / "quality_evaluation.json", "w") as f:
-            json.dump(json.loads(evaluation.model_dump_json()), f, indent=4)
+            f.write(evaluation.model_dump_json(indent=4))
+
+    def _resolve_op(self, operation: Union[str, Callable]) -> Callable:
+        """Resolve a comparison operation to a two-argument function.
+
+        Parameters
+        ----------
+        operation : str or Callable
+            One of the keys of ``OPERATORS`` or a custom comparison function
+
+        Returns
+        -------
+        Callable
+            Comparison function taking a value and a threshold
+
+        Raises
+        ------
+        ValueError
+            If operation string is not recognized
+        TypeError
+            If operation is neither a string nor a callable
+        """
+        if callable(operation):
+            return operation
+        if not isinstance(operation, str):
+            raise TypeError(
+                "Operation must be either a string or a callable, "
+                f"got {type(operation)}"
+            )
+        try:
+            return self.OPERATORS[operation]
+        except KeyError:
+            raise ValueError(
+                f"Unknown operation '{operation}'. "
+                f"Must be one of {list(self.OPERATORS.keys())}"
+            ) from None
 
     def evaluate_metrics(
         self,
@@ -294,24 +539,8 @@ class Evaluation:
         TypeError
             If operation is neither a string nor a callable
         """
-        if isinstance(operation, str):
-            if operation not in Evaluation.OPERATORS:
-                raise ValueError(
-                    f"Unknown operation '{operation}'. "
-                    f"Must be one of {list(Evaluation.OPERATORS.keys())}"
-                )
-            compare_func = Evaluation.OPERATORS[operation]
-
-        elif callable(operation):
-            compare_func = operation
-
-        else:
-            raise TypeError(
-                "Operation must be either a string or a callable, "
-                f"got {type(operation)}"
-            )
-
-        return any(compare_func(value, threshold) for value in metrics.values())
+        compare_func = self._resolve_op(operation)
+        return any(map(compare_func, metrics.values(), repeat(threshold)))
 
     def evaluate_metrics_all(
         self,
@@ -320,19 +549,5 @@ class Evaluation:
         operation: Union[str, Callable] = ">",
     ) -> bool:
         """Similar to evaluate_metrics but requires all values to satisfy the condition"""
-        if isinstance(operation, str):
-            if operation not in cls.OPERATORS:
-                raise ValueError(
-                    f"Unknown operation '{operation}'. "
-                    f"Must be one of {list(cls.OPERATORS.keys())}"
-                )
-            compare_func = cls.OPERATORS[operation]
-        elif callable(operation):
-            compare_func = operation
-        else:
-            raise TypeError(
-                "Operation must be either a string or a callable, "
-                f"got {type(operation)}"
-            )
-
-        return all(compare_func(value, threshold) for value in metrics.values())
+        compare_func = self._resolve_op(operation)
+        return all(map(compare_func, metrics.values(), repeat(threshold)))
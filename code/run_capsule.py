@@ -3,8 +3,10 @@
 import argparse
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from pathlib import Path
+from typing import Iterable, List, Optional, Type
 
 from aind_data_schema.core.processing import (DataProcess, PipelineProcess,
                                               Processing)
@@ -14,6 +16,7 @@ from aind_data_schema.core.quality_control import (QCEvaluation, QCStatus,
 from aind_data_schema_models.modalities import Modality
 from aind_qcportal_schema.metric_value import CheckboxMetric
 from fov_summary.session_evaluation import Evaluation, EvaluationSettings
+from pydantic import BaseModel
 
 # Define a configuration for Image name and image format pattern
 # Store the
@@ -22,22 +25,60 @@ from fov_summary.session_evaluation import Evaluation, EvaluationSettings
 # append the images to a list
 # Create the final FOV summary
 
+POPHYS_MODALITY = Modality.from_abbreviation("pophys")
+# Shared by every metric status written during this run
+RUN_TIMESTAMP = dt.now()
+# Settings common to every evaluation written by this capsule
+BASE_SETTINGS = dict(
+    metric_status_history=[
+        QCStatus(
+            evaluator="Pending review", timestamp=RUN_TIMESTAMP, status=Status.PENDING
+        )
+    ],
+    stage=Stage.PROCESSING,
+    modality=POPHYS_MODALITY,
+)
+
+# Directories never searched for metadata files
+SKIPPED_DIRECTORIES = {"__pycache__"}
+
+
+def _find_files(root: Path, pattern: str) -> List[Path]:
+    """Find files whose name contains pattern, sorted by path
+
+    Hidden directories are skipped and symlinked directories are not followed
+    """
+    stack = [root]
+    matches = []
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not (
+                        entry.name.startswith(".")
+                        or entry.name in SKIPPED_DIRECTORIES
+                    ):
+                        stack.append(entry.path)
+                elif pattern in entry.name and entry.is_file():
+                    matches.append(Path(entry.path))
+    return sorted(matches)
 
-def write_fov_summary(input_dir: Path, output_dir: Path):
+
+def _read_json(file: Path) -> dict:
+    """Read a json file"""
+    with open(file) as f:
+        return json.load(f)
+
+
+def write_fov_summary(input_dir: Path, output_dir: Path) -> QCEvaluation:
     """Write FOV summary to quality evaluation json file"""
     fov_evaluation_settings = EvaluationSettings(
+        **BASE_SETTINGS,
         input_directory=input_dir,
         output_directory=output_dir / "registration_summary",
         folder_name="motion_correction",
         pattern=["average_projection.png", "maximum_projection.png"],
         metric_name="Field of view summary",
-        metric_status_history=[
-            QCStatus(
-                evaluator="Pending review", timestamp=dt.now(), status=Status.PENDING
-            )
-        ],
-        stage=Stage.PROCESSING,
-        modality=Modality.from_abbreviation("pophys"),
         evaluations_name="Registration Summary",
         allow_failed_metrics=True,
     )
@@ -62,23 +103,18 @@ def write_fov_summary(input_dir: Path, output_dir: Path):
     )
     evaluation = fov_evaluation.build_qc_evaluation([metric])
     fov_evaluation.write_evaluation_to_json(evaluation)
+    return evaluation
 
 
-def write_interictal_summary(input_dir: Path, output_dir: Path):
+def write_interictal_summary(input_dir: Path, output_dir: Path) -> QCEvaluation:
     """Write the interictal summary to a combined image and json file"""
     interictal_evaluation_settings = EvaluationSettings(
+        **BASE_SETTINGS,
         input_directory=input_dir,
         output_directory=output_dir / "interictal_summary",
         folder_name="movie_qc",
         pattern=["registered_epilepsy_probability.png"],
         metric_name="Interictal Event Images",
-        metric_status_history=[
-            QCStatus(
-                evaluator="Pending review", timestamp=dt.now(), status=Status.PENDING
-            )
-        ],
-        stage=Stage.PROCESSING,
-        modality=Modality.from_abbreviation("pophys"),
         evaluations_name="Interictal Event Images",
         allow_failed_metrics=True,
     )
@@ -100,61 +136,75 @@ def write_interictal_summary(input_dir: Path, output_dir: Path):
     )
     evaluation = interictal_evaluation.build_qc_evaluation([metric])
     interictal_evaluation.write_evaluation_to_json(evaluation)
+    return evaluation
 
 
-def write_event_probability(input_dir: Path, output_dir: Path):
+def write_event_probability(input_dir: Path, output_dir: Path) -> QCEvaluation:
     """Writes the epilepsy probability summary to a json file"""
     event_probability = EvaluationSettings(
+        **BASE_SETTINGS,
         input_directory=input_dir,
         output_directory=output_dir / "epilepsy_probability",
         folder_name="movie_qc",
         pattern=["registered_metrics.json"],
         metric_name="Epilepsy Probability",
-        metric_status_history=[
-            QCStatus(
-                evaluator="Pending review", timestamp=dt.now(), status=Status.PENDING
-            )
-        ],
-        stage=Stage.PROCESSING,
-        modality=Modality.from_abbreviation("pophys"),
         evaluations_name="Epilepsy Probability",
         allow_failed_metrics=False,
     )
     event_probability_evaluation = Evaluation(event_probability)
     row_labels, matched_files = event_probability_evaluation.collect_pattern_files()
-    epilepsy_metric_summary = {}
-    for label, file in zip(row_labels, matched_files):
-        with open(file) as f:
-            data = json.load(f)
-        epilepsy_metric_summary[label] = data["epilepsy_probability"]
+    with ThreadPoolExecutor(max_workers=min(32, len(matched_files) or 1)) as executor:
+        metrics = list(executor.map(_read_json, matched_files))
+    epilepsy_metric_summary = {
+        label: data["epilepsy_probability"] for label, data in zip(row_labels, metrics)
+    }
     evaluation_metric = event_probability_evaluation.evaluate_metrics(
         epilepsy_metric_summary, 0.5
     )
     metric = event_probability_evaluation.build_qc_metric(value=evaluation_metric)
     evaluation = event_probability_evaluation.build_qc_evaluation([metric])
     event_probability_evaluation.write_evaluation_to_json(evaluation)
+    return evaluation
+
 
+def _load_models(model_cls: Type[BaseModel], files: Iterable[Path]) -> list:
+    """Load and validate json files as model_cls on a thread pool"""
+    with ThreadPoolExecutor() as executor:
+        return list(
+            executor.map(
+                lambda file: model_cls.model_validate_json(file.read_bytes()), files
+            )
+        )
 
-def write_core_metadata(input_dir: Path, output_dir: Path, **kwargs):
-    """Writes final quality control json by aggregating evaluations"""
-    for data_type in kwargs.values():
-        if "evaluation" in data_type.lower():
-            file_path = output_dir.rglob(f"*{data_type}*")
-        elif "data_process" in data_type.lower():
-            file_path = input_dir.rglob(f"*{data_type}*")
-    metadata = []
-    for file in file_path:
-        with open(file) as j:
-            data = json.load(j)
-        if "evaluation" in str(file):
-            metadata.append(QCEvaluation(**data))
-        elif "data_process" in str(file):
-            metadata.append(DataProcess(**data))
-    if "evaluation" in kwargs["data_type"]:
-        core_metadata = QualityControl(evaluations=metadata)
-    elif "data_process" in kwargs["data_type"]:
-        core_metadata = Processing(
-            processing_pipeline=PipelineProcess(
+
+def write_core_metadata(
+    input_dir: Path,
+    output_dir: Path,
+    evaluations: Optional[List[QCEvaluation]] = None,
+    **kwargs,
+):
+    """Writes final quality control json by aggregating evaluations
+
+    Evaluations built during this run can be passed directly, in which case
+    they are not read back from output_dir
+    """
+    data_type = kwargs["data_type"]
+    if "evaluation" in data_type.lower():
+        model_cls, base_dir = QCEvaluation, output_dir
+    elif "data_process" in data_type.lower():
+        model_cls, base_dir = DataProcess, input_dir
+    else:
+        raise ValueError(f"Unknown data type '{data_type}'.")
+    if model_cls is QCEvaluation and evaluations is not None:
+        metadata = list(evaluations)
+    else:
+        metadata = _load_models(model_cls, _find_files(base_dir, data_type))
+    # Nested models were validated when loaded, skip revalidating them
+    if model_cls is QCEvaluation:
+        core_metadata = QualityControl.model_construct(evaluations=metadata)
+    else:
+        core_metadata = Processing.model_construct(
+            processing_pipeline=PipelineProcess.model_construct(
                 processor_full_name="Multplane Ophys Processing Pipeline",
                 pipeline_url=os.getenv("PIPELINE_URL", ""),
                 pipeline_version=os.getenv("PIPELINE_VERSION", ""),
@@ -183,13 +233,21 @@ if __name__ == "__main__":
     args = parser.parse_args()
     input_dir = Path(args.input_dir)
     output_dir = Path(args.output_dir)
-    # Build the fov summary metric
-    write_fov_summary(input_dir, output_dir)
-    # Build the interictal summary images
-    write_interictal_summary(input_dir, output_dir)
-    # Build the epilepsy probability metric
-    write_event_probability(input_dir, output_dir)
-    # Write quality control json    # Aggregate data procs and build processing json
-    write_core_metadata(input_dir, output_dir, data_type="evaluation")
+    # Build the fov summary metric, the interictal summary images and the
+    # epilepsy probability metric. They share no state, so run them together
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        summaries = [
+            executor.submit(write_summary, input_dir, output_dir)
+            for write_summary in (
+                write_fov_summary,
+                write_interictal_summary,
+                write_event_probability,
+            )
+        ]
+        evaluations = [summary.result() for summary in summaries]
+    # Write quality control json from the evaluations built above
+    write_core_metadata(
+        input_dir, output_dir, evaluations=evaluations, data_type="evaluation"
+    )
     # Write processing json
     write_core_metadata(input_dir, output_dir, data_type="data_process")
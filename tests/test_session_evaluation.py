@@ -0,0 +1,117 @@
+"""Tests for the session_evaluation module."""
+
+import os
+from pathlib import Path
+
+import pytest
+from aind_data_schema.core.quality_control import Stage
+from aind_data_schema_models.modalities import Modality
+from fov_summary.session_evaluation import Evaluation, EvaluationSettings
+from PIL import Image
+
+
+def _make_plane(directory: Path):
+    """Create a plane folder holding a motion_correction average projection"""
+    (directory / "motion_correction").mkdir(parents=True)
+    (directory / "motion_correction" / "average_projection.png").touch()
+
+
+def _evaluation(input_dir: Path, output_dir: Path) -> Evaluation:
+    """Build an evaluation of the average projections in input_dir"""
+    settings = EvaluationSettings(
+        input_directory=input_dir,
+        output_directory=output_dir,
+        folder_name="motion_correction",
+        pattern=["average_projection.png"],
+        metric_name="Field of view summary",
+        stage=Stage.PROCESSING,
+        modality=Modality.from_abbreviation("pophys"),
+        evaluations_name="Registration Summary",
+        allow_failed_metrics=True,
+    )
+    return Evaluation(settings)
+
+
+def _collect(input_dir: Path, output_dir: Path):
+    """Collect average projections from input_dir"""
+    return _evaluation(input_dir, output_dir).collect_pattern_files()
+
+
+def test_symlinked_plane_directories(tmp_path):
+    """Planes staged as symlinks into a work directory are searched"""
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for plane in ("plane_a", "plane_b"):
+        _make_plane(tmp_path / "work" / plane)
+        os.symlink(tmp_path / "work" / plane, input_dir / plane)
+
+    row_labels, matched_files = _collect(input_dir, tmp_path / "out")
+
+    assert row_labels == ["plane_a", "plane_b"]
+    assert [file.parent.parent.name for file in matched_files] == row_labels
+
+
+def test_symlinked_folder_directory(tmp_path):
+    """A symlinked folder_name directory is searched"""
+    input_dir = tmp_path / "in"
+    _make_plane(input_dir / "plane_a")
+    _make_plane(tmp_path / "work" / "plane_b")
+    (input_dir / "plane_b").mkdir()
+    os.symlink(
+        tmp_path / "work" / "plane_b" / "motion_correction",
+        input_dir / "plane_b" / "motion_correction",
+    )
+
+    row_labels, _ = _collect(input_dir, tmp_path / "out")
+
+    assert row_labels == ["plane_a", "plane_b"]
+
+
+def test_symlink_aliases_and_cycles_are_skipped(tmp_path):
+    """Links back into the session neither duplicate planes nor loop"""
+    input_dir = tmp_path / "in"
+    for plane in ("plane_a", "plane_b", "plane_c"):
+        _make_plane(input_dir / plane)
+    os.symlink("../plane_b", input_dir / "plane_a" / "alias")
+    os.symlink("..", input_dir / "plane_a" / "loop")
+
+    row_labels, _ = _collect(input_dir, tmp_path / "out")
+
+    assert row_labels == ["plane_a", "plane_b", "plane_c"]
+
+
+def _tiles(directory: Path, sizes) -> list:
+    """Write opaque black tiles of the given sizes"""
+    paths = []
+    for idx, size in enumerate(sizes):
+        path = directory / f"tile_{idx}.png"
+        Image.new("RGB", size, (0, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_combine_images_centres_smaller_tiles(tmp_path):
+    """A tile smaller than the first one is centred in its cell"""
+    _make_plane(tmp_path / "in" / "plane_a")
+    evaluation = _evaluation(tmp_path / "in", tmp_path / "out")
+    paths = _tiles(tmp_path, [(60, 40), (50, 40)])
+
+    output = evaluation.combine_images(paths, "combined.png", spacing=10)
+
+    with Image.open(output) as combined:
+        assert combined.size == (130, 40)
+        # The second cell starts at x=70, the 50 px tile is inset by 5 px
+        assert combined.getpixel((74, 20)) == (255, 255, 255)
+        assert combined.getpixel((75, 20)) == (0, 0, 0)
+        assert combined.getpixel((124, 20)) == (0, 0, 0)
+        assert combined.getpixel((125, 20)) == (255, 255, 255)
+
+
+def test_combine_images_rejects_larger_tiles(tmp_path):
+    """A tile larger than the first one raises ValueError"""
+    _make_plane(tmp_path / "in" / "plane_a")
+    evaluation = _evaluation(tmp_path / "in", tmp_path / "out")
+    paths = _tiles(tmp_path, [(50, 40), (60, 40)])
+
+    with pytest.raises(ValueError, match="larger than"):
+        evaluation.combine_images(paths, "combined.png")